@@ -0,0 +1,199 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict
+from typing import Tuple
+
+from fastapi import HTTPException
+
+
+# Ограничения для дорогих маршрутов. Остальные маршруты (вход, списки
+# заявок) не ограничиваются и не ждут в очереди, поэтому нагрузка
+# на дорогие маршруты не вытесняет интерактивные запросы.
+#   concurrency   - одновременно выполняемых запросов
+#   queue         - запросов, ожидающих свободного места
+#   queue_timeout - сколько запрос может ждать в очереди, секунды
+#   rate, burst   - пополнение и ёмкость корзины токенов пользователя
+DEFAULT_LIMITS = {
+    "recommendations": {
+        "concurrency": 4,
+        "queue": 16,
+        "queue_timeout": 2.0,
+        "rate": 2.0,
+        "burst": 5,
+    },
+    "knowledge": {
+        "concurrency": 2,
+        "queue": 8,
+        "queue_timeout": 2.0,
+        "rate": 1.0,
+        "burst": 3,
+    },
+    "search": {
+        "concurrency": 4,
+        "queue": 16,
+        "queue_timeout": 2.0,
+        "rate": 3.0,
+        "burst": 6,
+    },
+}
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+
+# Переопределение ограничений, например:
+# ADMISSION_LIMITS='{"knowledge": {"concurrency": 4}}'
+ADMISSION_LIMITS = json.loads(os.getenv("ADMISSION_LIMITS", "{}"))
+
+# При превышении числа корзин удаляется давно не использовавшаяся
+MAX_BUCKETS = 10000
+
+
+class RouteAdmission:
+    """
+    Ограничение одного маршрута: корзина токенов на пользователя,
+    лимит одновременных запросов и ограниченная очередь ожидания.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        queue: int,
+        queue_timeout: float,
+        rate: float,
+        burst: int,
+    ):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = burst
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._waiting = 0
+        self._running = 0
+        self._buckets: "OrderedDict[int, Tuple[float, float]]" = OrderedDict()
+
+        self.counters = {
+            "admitted": 0,
+            "queued": 0,
+            "shed_rate": 0,
+            "shed_queue": 0,
+        }
+
+    def _tokens(self, user_id: int, now: float) -> float:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            return self.burst
+
+        tokens, updated = bucket
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def _token_wait(self, user_id: int) -> float:
+        """
+        Проверяет корзину пользователя, не забирая токен. Возвращает 0,
+        если токен есть, или время в секундах до его появления.
+        """
+        tokens = self._tokens(user_id, time.monotonic())
+
+        if tokens < 1:
+            return (1 - tokens) / self.rate
+
+        return 0
+
+    def _take_token(self, user_id: int) -> None:
+        """
+        Списывает токен после получения места. Параллельные запросы
+        пользователя, прошедшие проверку, могут увести корзину в минус:
+        следующий токен появится позже.
+        """
+        now = time.monotonic()
+        self._buckets[user_id] = (self._tokens(user_id, now) - 1, now)
+        self._buckets.move_to_end(user_id)
+
+        if len(self._buckets) > MAX_BUCKETS:
+            self._buckets.popitem(last=False)
+
+    def _shed(self, status_code: int, counter: str, retry_after: float):
+        self.counters[counter] += 1
+        return HTTPException(
+            status_code=status_code,
+            detail="Сервер перегружен, повторите запрос позже",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    async def acquire(self, user_id: int) -> None:
+        wait = self._token_wait(user_id)
+        if wait:
+            raise self._shed(429, "shed_rate", wait)
+
+        if self._semaphore.locked():
+            if self._waiting >= self.queue:
+                raise self._shed(503, "shed_queue", self.queue_timeout)
+
+            self._waiting += 1
+            self.counters["queued"] += 1
+
+            try:
+                await asyncio.wait_for(
+                    self._semaphore.acquire(),
+                    self.queue_timeout,
+                )
+            except asyncio.TimeoutError:
+                raise self._shed(503, "shed_queue", self.queue_timeout)
+            finally:
+                self._waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self._take_token(user_id)
+        self._running += 1
+        self.counters["admitted"] += 1
+
+    def release(self) -> None:
+        self._running -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict:
+        return {
+            **self.counters,
+            "running": self._running,
+            "waiting": self._waiting,
+            "concurrency": self.concurrency,
+            "queue": self.queue,
+        }
+
+
+routes: Dict[str, RouteAdmission] = {
+    name: RouteAdmission(name, **{**limits, **ADMISSION_LIMITS.get(name, {})})
+    for name, limits in DEFAULT_LIMITS.items()
+}
+
+
+def limit(route: str):
+    """
+    Зависимость FastAPI, пропускающая запрос к дорогому маршруту
+    только в пределах его ограничений.
+    """
+    admission = routes[route]
+
+    async def dependency(user_id: int):
+        if not ADMISSION_ENABLED:
+            yield
+            return
+
+        await admission.acquire(user_id)
+        try:
+            yield
+        finally:
+            admission.release()
+
+    return dependency
+
+
+def stats() -> Dict[str, Dict]:
+    return {name: r.stats() for name, r in routes.items()}
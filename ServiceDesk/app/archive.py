@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from typing import Iterable
+from typing import List
+
+from sqlalchemy import delete
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from . import versions
+from .database import SessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+# Закрытые заявки старше этого срока (по дате последнего изменения)
+# переносятся в архив
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+
+# Количество заявок, переносимых в одной транзакции
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+
+# Период запуска архивации внутри приложения, секунды; 0 - отключено.
+# Архивация выполняется только процессом приложения: перенос заявок меняет
+# список "Мои заявки", и версии очередей (versions) должны увеличиться
+# в том же процессе, иначе клиенты получат 304 с устаревшим списком.
+# По умолчанию выключена: архивные заявки возвращаются только с history=true,
+# а интерфейс этот параметр не передаёт.
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", "0"))
+
+TICKET_COLUMNS = [
+    "id",
+    "description",
+    "contact_info",
+    "status_id",
+    "priority",
+    "client_user_id",
+    "specialist_user_id",
+    "created_at",
+    "updated_at",
+]
+
+RECOMMENDATION_COLUMNS = [
+    "id",
+    "ticket_id",
+    "kb_item_id",
+    "similarity",
+    "rank",
+    "was_accepted",
+    "created_at",
+]
+
+
+def month_start(value: datetime) -> date:
+    return date(value.year, value.month, 1)
+
+
+def next_month(value: date) -> date:
+    if value.month == 12:
+        return date(value.year + 1, 1, 1)
+    return date(value.year, value.month + 1, 1)
+
+
+async def ensure_partitions(
+    db: AsyncSession,
+    table_name: str,
+    months: Iterable[date],
+) -> None:
+    """
+    Создаёт недостающие помесячные секции архивной таблицы.
+    """
+    months = sorted(set(months))
+    if not months:
+        return
+
+    # CREATE TABLE IF NOT EXISTS не защищён от параллельного создания той же
+    # секции другим процессом, поэтому создание секций таблицы выполняется
+    # под транзакционной блокировкой, снимаемой при завершении транзакции
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(:name))"),
+        {"name": table_name},
+    )
+
+    for month in months:
+        partition = f"{table_name}_{month:%Y_%m}"
+        await db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition} "
+            f"PARTITION OF {table_name} "
+            f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+        ))
+
+
+async def archive_batch(
+    db: AsyncSession,
+    older_than_days: int,
+    batch_size: int,
+) -> List:
+    """
+    Переносит в архив одну пачку закрытых заявок вместе с их
+    рекомендациями. Возвращает перенесённые строки (id, client_user_id).
+    """
+    result = await db.execute(
+        select(
+            models.Ticket.id,
+            models.Ticket.client_user_id,
+            models.Ticket.created_at,
+        )
+        .where(models.Ticket.status_id == 4)
+        .where(
+            models.Ticket.updated_at
+            < func.now() - timedelta(days=older_than_days)
+        )
+        .order_by(models.Ticket.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    rows = result.all()
+
+    if not rows:
+        await db.rollback()
+        return []
+
+    ticket_ids = [row.id for row in rows]
+
+    result = await db.execute(
+        select(func.date_trunc("month", models.TicketRecommendation.created_at))
+        .where(models.TicketRecommendation.ticket_id.in_(ticket_ids))
+        .distinct()
+    )
+    recommendation_months = [month_start(m) for m in result.scalars()]
+
+    await ensure_partitions(
+        db,
+        models.TicketArchive.__tablename__,
+        (month_start(row.created_at) for row in rows),
+    )
+    await ensure_partitions(
+        db,
+        models.TicketRecommendationArchive.__tablename__,
+        recommendation_months,
+    )
+
+    # Сначала рекомендации: они ссылаются на заявки внешним ключом
+    recommendations = models.TicketRecommendation.__table__
+    await db.execute(
+        insert(models.TicketRecommendationArchive).from_select(
+            RECOMMENDATION_COLUMNS,
+            select(*(recommendations.c[c] for c in RECOMMENDATION_COLUMNS))
+            .where(recommendations.c.ticket_id.in_(ticket_ids)),
+        )
+    )
+    await db.execute(
+        delete(models.TicketRecommendation)
+        .where(models.TicketRecommendation.ticket_id.in_(ticket_ids))
+    )
+
+    tickets = models.Ticket.__table__
+    await db.execute(
+        insert(models.TicketArchive).from_select(
+            TICKET_COLUMNS,
+            select(*(tickets.c[c] for c in TICKET_COLUMNS))
+            .where(tickets.c.id.in_(ticket_ids)),
+        )
+    )
+    await db.execute(
+        delete(models.Ticket).where(models.Ticket.id.in_(ticket_ids))
+    )
+
+    await db.commit()
+
+    return rows
+
+
+async def archive_closed_tickets(
+    older_than_days: int = ARCHIVE_AFTER_DAYS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+) -> int:
+    """
+    Переносит в архив все закрытые заявки старше заданного срока
+    пачками по batch_size. Возвращает число перенесённых заявок.
+    """
+    archived = 0
+
+    while True:
+        async with SessionLocal() as db:
+            rows = await archive_batch(db, older_than_days, batch_size)
+
+        if not rows:
+            return archived
+
+        for client_id in {row.client_user_id for row in rows}:
+            versions.bump(versions.MY_QUEUE, client_id)
+
+        archived += len(rows)
+
+
+async def run_archiver(interval: int = ARCHIVE_INTERVAL) -> None:
+    while True:
+        try:
+            archived = await archive_closed_tickets()
+            if archived:
+                logger.info("Архивация: перенесено заявок %s", archived)
+        except Exception:
+            logger.exception("Ошибка архивации заявок")
+
+        await asyncio.sleep(interval)
@@ -0,0 +1,227 @@
+import logging
+import math
+import os
+from collections import Counter
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from sqlalchemy import select
+
+from . import models
+from .database import SessionLocal
+from .ml_logic import normalize_text
+
+
+logger = logging.getLogger(__name__)
+
+# Минимальное косинусное сходство заявки с центром кластера
+CLUSTER_THRESHOLD = float(os.getenv("CLUSTER_THRESHOLD", "0.5"))
+
+# Максимальное число живых кластеров; давно не пополнявшиеся вытесняются
+MAX_CLUSTERS = int(os.getenv("MAX_CLUSTERS", "2000"))
+
+# Сколько незакрытых заявок загружать в кластеры при запуске
+WARM_UP_LIMIT = int(os.getenv("CLUSTER_WARM_UP_LIMIT", "5000"))
+
+
+def vectorize(text: str) -> Dict[str, float]:
+    """
+    Строит нормированный вектор заявки по леммам и биграммам лемм,
+    как признаки TF-IDF в ml_logic, но без обучения на корпусе.
+    """
+    lemmas = normalize_text(text).split()
+    features = lemmas + [f"{a} {b}" for a, b in zip(lemmas, lemmas[1:])]
+
+    counts = Counter(features)
+    norm = math.sqrt(sum(v * v for v in counts.values()))
+
+    if not norm:
+        return {}
+
+    return {f: v / norm for f, v in counts.items()}
+
+
+class IncidentCluster:
+    def __init__(self, cluster_id: int, description: str):
+        self.id = cluster_id
+        self.description = description
+
+        # Центр кластера хранится как сумма векторов заявок
+        self.centroid: Dict[str, float] = {}
+        self.square = 0.0
+
+        self.ticket_ids: Set[int] = set()
+        self.total = 0
+
+        self.created_at = datetime.now()
+        self.updated_at = self.created_at
+
+        # Рекомендации, вычисленные для первой заявки кластера
+        self.recommendations: Optional[Dict] = None
+
+    @property
+    def norm(self) -> float:
+        return math.sqrt(self.square)
+
+    def add(self, ticket_id: int, vector: Dict[str, float]) -> None:
+        for feature, weight in vector.items():
+            old = self.centroid.get(feature, 0.0)
+            new = old + weight
+            self.centroid[feature] = new
+            self.square += new * new - old * old
+
+        self.ticket_ids.add(ticket_id)
+        self.total += 1
+        self.updated_at = datetime.now()
+
+
+class IncidentClusterer:
+    """
+    Инкрементальная кластеризация входящих заявок. Кандидаты для новой
+    заявки ищутся через обратный индекс признак -> кластеры, поэтому
+    время распределения зависит от длины заявки, а не от числа заявок.
+    """
+
+    def __init__(
+        self,
+        threshold: float = CLUSTER_THRESHOLD,
+        max_clusters: int = MAX_CLUSTERS,
+    ):
+        self.threshold = threshold
+        self.max_clusters = max_clusters
+
+        self._clusters: "OrderedDict[int, IncidentCluster]" = OrderedDict()
+        self._index: Dict[str, Set[int]] = {}
+        self._ticket_cluster: Dict[int, int] = {}
+        self._next_id = 1
+
+    def _nearest(self, vector: Dict[str, float]) -> Tuple[Optional[IncidentCluster], float]:
+        dots: Dict[int, float] = {}
+
+        for feature, weight in vector.items():
+            for cluster_id in self._index.get(feature, ()):
+                centroid = self._clusters[cluster_id].centroid
+                dots[cluster_id] = dots.get(cluster_id, 0.0) + weight * centroid[feature]
+
+        best = None
+        best_score = 0.0
+
+        for cluster_id, dot in dots.items():
+            cluster = self._clusters[cluster_id]
+            score = dot / cluster.norm
+
+            if score > best_score:
+                best = cluster
+                best_score = score
+
+        return best, best_score
+
+    def _drop(self, cluster: IncidentCluster) -> None:
+        for feature in cluster.centroid:
+            ids = self._index.get(feature)
+            if ids is not None:
+                ids.discard(cluster.id)
+                if not ids:
+                    del self._index[feature]
+
+        for ticket_id in cluster.ticket_ids:
+            self._ticket_cluster.pop(ticket_id, None)
+
+        del self._clusters[cluster.id]
+
+    def add_ticket(self, ticket_id: int, text: str) -> Optional[IncidentCluster]:
+        """
+        Относит заявку к ближайшему кластеру или создаёт новый.
+        """
+        vector = vectorize(text)
+        if not vector:
+            return None
+
+        cluster, score = self._nearest(vector)
+
+        if cluster is None or score < self.threshold:
+            cluster = IncidentCluster(self._next_id, text[:300])
+            self._clusters[cluster.id] = cluster
+            self._next_id += 1
+
+        cluster.add(ticket_id, vector)
+        self._clusters.move_to_end(cluster.id)
+        self._ticket_cluster[ticket_id] = cluster.id
+
+        for feature in vector:
+            self._index.setdefault(feature, set()).add(cluster.id)
+
+        while len(self._clusters) > self.max_clusters:
+            _, oldest = next(iter(self._clusters.items()))
+            self._drop(oldest)
+
+        return cluster
+
+    def remove_tickets(self, ticket_ids: Iterable[int]) -> None:
+        """
+        Убирает выполненные заявки; опустевшие кластеры удаляются.
+        """
+        for ticket_id in ticket_ids:
+            cluster_id = self._ticket_cluster.pop(ticket_id, None)
+            if cluster_id is None:
+                continue
+
+            cluster = self._clusters[cluster_id]
+            cluster.ticket_ids.discard(ticket_id)
+
+            if not cluster.ticket_ids:
+                self._drop(cluster)
+
+    def get(self, cluster_id: int) -> Optional[IncidentCluster]:
+        return self._clusters.get(cluster_id)
+
+    def cluster_of(self, ticket_id: int) -> Optional[IncidentCluster]:
+        cluster_id = self._ticket_cluster.get(ticket_id)
+        if cluster_id is None:
+            return None
+        return self._clusters.get(cluster_id)
+
+    def clusters(self, min_size: int = 1) -> List[IncidentCluster]:
+        result = [
+            c for c in self._clusters.values()
+            if len(c.ticket_ids) >= min_size
+        ]
+        result.sort(key=lambda c: len(c.ticket_ids), reverse=True)
+        return result
+
+    def invalidate_recommendations(self) -> None:
+        """
+        Сбрасывает кэш рекомендаций после изменения базы знаний.
+        """
+        for cluster in self._clusters.values():
+            cluster.recommendations = None
+
+
+clusterer = IncidentClusterer()
+
+
+async def warm_up_clusters(limit: int = WARM_UP_LIMIT) -> None:
+    """
+    Восстанавливает кластеры по незакрытым заявкам после перезапуска.
+    """
+    try:
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(models.Ticket.id, models.Ticket.description)
+                .where(models.Ticket.status_id.in_([1, 2]))
+                .order_by(models.Ticket.created_at.desc())
+                .limit(limit)
+            )
+            rows = result.all()
+    except Exception:
+        logger.exception("Не удалось загрузить заявки для кластеризации")
+        return
+
+    for row in reversed(rows):
+        clusterer.add_ticket(row.id, row.description)
@@ -0,0 +1,59 @@
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+
+async def claim_next_ticket(
+    db: AsyncSession,
+    specialist_id: int,
+    by_priority: bool = True,
+    skill: Optional[str] = None,
+) -> Optional[models.Ticket]:
+    """
+    Атомарно забирает следующую открытую заявку и назначает её специалисту.
+    Строки, уже заблокированные другими специалистами, пропускаются
+    (FOR UPDATE SKIP LOCKED), поэтому параллельные запросы не ждут
+    друг друга и не получают одну и ту же заявку.
+    """
+    query = select(models.Ticket).where(models.Ticket.status_id == 1)
+
+    # Маршрутизация по навыку: специалист берёт только заявки по своей теме
+    if skill:
+        # % и _ в навыке ищутся как обычные символы, а не как шаблон
+        pattern = (
+            skill.replace("\\", "\\\\")
+            .replace("%", "\\%")
+            .replace("_", "\\_")
+        )
+        query = query.where(
+            models.Ticket.description.ilike(f"%{pattern}%", escape="\\")
+        )
+
+    if by_priority:
+        query = query.order_by(
+            models.Ticket.priority.desc(),
+            models.Ticket.created_at,
+            models.Ticket.id,
+        )
+    else:
+        # Порядок поступления обслуживает индекс ix_tickets_fifo
+        query = query.order_by(models.Ticket.created_at, models.Ticket.id)
+
+    result = await db.execute(
+        query.limit(1).with_for_update(skip_locked=True)
+    )
+    ticket = result.scalar_one_or_none()
+
+    if not ticket:
+        await db.rollback()
+        return None
+
+    ticket.status_id = 2
+    ticket.specialist_user_id = specialist_id
+
+    await db.commit()
+
+    return ticket
@@ -1,11 +1,18 @@
+import asyncio
 import hashlib
+from contextlib import asynccontextmanager
 from typing import List
+from typing import Optional
 
 from fastapi import Depends
 from fastapi import FastAPI
+from fastapi import Header
 from fastapi import HTTPException
+from fastapi import Query
+from fastapi import Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy import func
 from sqlalchemy import select
@@ -15,13 +22,45 @@ from sqlalchemy.orm import selectinload
 from starlette.requests import Request
 from starlette.templating import Jinja2Templates
 
+from . import admission
 from . import models
+from . import profiling
 from . import schemas
+from . import versions
+from .archive import ARCHIVE_INTERVAL
+from .archive import run_archiver
+from .clustering import clusterer
+from .clustering import warm_up_clusters
 from .database import get_db
+from .dispatch import claim_next_ticket
 from .ml_logic import get_recommendations
+from .search import search as run_search
+from .write_buffer import write_buffer
 
 
-app = FastAPI(title="Система управления заявками")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    write_buffer.start()
+    await warm_up_clusters()
+
+    archiver = None
+    if ARCHIVE_INTERVAL > 0:
+        archiver = asyncio.create_task(run_archiver(ARCHIVE_INTERVAL))
+
+    yield
+
+    if archiver:
+        # Незавершённая пачка архивации откатывается вместе с транзакцией
+        archiver.cancel()
+        try:
+            await archiver
+        except asyncio.CancelledError:
+            pass
+
+    await write_buffer.stop()
+
+
+app = FastAPI(title="Система управления заявками", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,6 +69,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if profiling.PROFILING_ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware)
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
@@ -60,6 +102,30 @@ def require_role(user: models.User, role_code: str) -> None:
         raise HTTPException(status_code=403, detail="Недостаточно прав")
 
 
+def queue_etag(
+    response: Response,
+    if_none_match: Optional[str],
+    queue: str,
+    owner_id: Optional[int] = None,
+    variant: str = "",
+) -> Optional[Response]:
+    """
+    Проставляет ETag очереди. Если клиент прислал актуальную версию,
+    возвращает ответ 304, и список заявок из базы не запрашивается.
+    """
+    if not versions.ETAGS_ENABLED:
+        return None
+
+    etag = versions.make_etag(queue, owner_id, variant)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if versions.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return None
+
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
@@ -123,27 +189,68 @@ async def create_ticket(
     await db.commit()
     await db.refresh(ticket)
 
+    versions.bump(versions.OPEN_QUEUE)
+    versions.bump(versions.MY_QUEUE, user.id)
+
+    clusterer.add_ticket(ticket.id, ticket.description)
+
     return ticket
 
 
 @app.get("/api/tickets/my", response_model=List[schemas.TicketResponse])
-async def my_tickets(user_id: int, db: AsyncSession = Depends(get_db)):
+async def my_tickets(
+    user_id: int,
+    response: Response,
+    history: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+):
     user = await get_user(db, user_id)
     require_role(user, "user")
 
+    not_modified = queue_etag(
+        response,
+        if_none_match,
+        versions.MY_QUEUE,
+        user.id,
+        "-history" if history else "",
+    )
+    if not_modified:
+        return not_modified
+
     result = await db.execute(
         select(models.Ticket)
         .where(models.Ticket.client_user_id == user.id)
         .order_by(models.Ticket.created_at.desc())
     )
-    return result.scalars().all()
+    tickets = list(result.scalars().all())
+
+    # Архив читается только по явному запросу истории
+    if history:
+        result = await db.execute(
+            select(models.TicketArchive)
+            .where(models.TicketArchive.client_user_id == user.id)
+        )
+        tickets.extend(result.scalars().all())
+        tickets.sort(key=lambda t: t.created_at, reverse=True)
+
+    return tickets
 
 
 @app.get("/api/tickets/open", response_model=List[schemas.TicketResponse])
-async def open_tickets(user_id: int, db: AsyncSession = Depends(get_db)):
+async def open_tickets(
+    user_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+):
     user = await get_user(db, user_id)
     require_role(user, "specialist")
 
+    not_modified = queue_etag(response, if_none_match, versions.OPEN_QUEUE)
+    if not_modified:
+        return not_modified
+
     result = await db.execute(
         select(models.Ticket)
         .where(models.Ticket.status_id == 1)
@@ -153,10 +260,21 @@ async def open_tickets(user_id: int, db: AsyncSession = Depends(get_db)):
 
 
 @app.get("/api/tickets/assigned", response_model=List[schemas.TicketResponse])
-async def assigned_tickets(user_id: int, db: AsyncSession = Depends(get_db)):
+async def assigned_tickets(
+    user_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+):
     user = await get_user(db, user_id)
     require_role(user, "specialist")
 
+    not_modified = queue_etag(
+        response, if_none_match, versions.ASSIGNED_QUEUE, user.id
+    )
+    if not_modified:
+        return not_modified
+
     result = await db.execute(
         select(models.Ticket)
         .where(models.Ticket.status_id == 2)
@@ -166,6 +284,28 @@ async def assigned_tickets(user_id: int, db: AsyncSession = Depends(get_db)):
     return result.scalars().all()
 
 
+@app.post("/api/tickets/next", response_model=schemas.TicketResponse)
+async def next_ticket(
+    user_id: int,
+    by_priority: bool = True,
+    skill: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    user = await get_user(db, user_id)
+    require_role(user, "specialist")
+
+    ticket = await claim_next_ticket(db, user.id, by_priority, skill)
+
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Нет открытых заявок")
+
+    versions.bump(versions.OPEN_QUEUE)
+    versions.bump(versions.ASSIGNED_QUEUE, user.id)
+    versions.bump(versions.MY_QUEUE, ticket.client_user_id)
+
+    return ticket
+
+
 @app.put("/api/tickets/{ticket_id}/assign")
 async def assign_ticket(
     ticket_id: int,
@@ -191,10 +331,53 @@ async def assign_ticket(
 
     await db.commit()
 
+    versions.bump(versions.OPEN_QUEUE)
+    versions.bump(versions.ASSIGNED_QUEUE, user.id)
+    versions.bump(versions.MY_QUEUE, ticket.client_user_id)
+
     return {"message": "Заявка взята в работу"}
 
 
-@app.get("/api/tickets/{ticket_id}/recommendations")
+@app.put("/api/tickets/{ticket_id}/priority")
+async def set_ticket_priority(
+    ticket_id: int,
+    data: schemas.PriorityRequest,
+    user_id: int,
+    db: AsyncSession = Depends(get_db),
+):
+    # Приоритет влияет на очередь специалистов, поэтому его задаёт
+    # специалист, а не клиент при создании заявки
+    user = await get_user(db, user_id)
+    require_role(user, "specialist")
+
+    result = await db.execute(
+        update(models.Ticket)
+        .where(models.Ticket.id == ticket_id)
+        .where(models.Ticket.status_id == 1)
+        .values(priority=data.priority)
+        .returning(models.Ticket.client_user_id)
+    )
+    client_id = result.scalar_one_or_none()
+
+    if client_id is None:
+        await db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail="Приоритет меняется только у открытых заявок",
+        )
+
+    await db.commit()
+
+    versions.bump(versions.OPEN_QUEUE)
+    versions.bump(versions.MY_QUEUE, client_id)
+
+    return {"message": "Приоритет изменён"}
+
+
+@app.get(
+    "/api/tickets/{ticket_id}/recommendations",
+    dependencies=[Depends(admission.limit("recommendations"))],
+)
 async def ticket_recommendations(
     ticket_id: int,
     user_id: int,
@@ -211,31 +394,31 @@ async def ticket_recommendations(
     if not ticket:
         raise HTTPException(status_code=404, detail="Заявка не найдена")
 
-    result = await db.execute(
-        select(models.KnowledgeItem)
-        .order_by(models.KnowledgeItem.frequency.desc())
-        .limit(100)
-    )
-    kb_items = result.scalars().all()
+    # Заявки одного инцидента получают рекомендации, вычисленные для кластера
+    cluster = clusterer.cluster_of(ticket.id)
 
-    kb_data = [
-        {"id": i.id, "problem": i.problem, "solution": i.solution}
-        for i in kb_items
-    ]
+    if cluster and cluster.recommendations is not None:
+        rec_data = cluster.recommendations
+    else:
+        result = await db.execute(
+            select(models.KnowledgeItem)
+            .order_by(models.KnowledgeItem.frequency.desc())
+            .limit(100)
+        )
+        kb_items = result.scalars().all()
 
-    rec_data = get_recommendations(ticket.description, kb_data)
+        kb_data = [
+            {"id": i.id, "problem": i.problem, "solution": i.solution}
+            for i in kb_items
+        ]
 
-    for rec in rec_data["recommendations"]:
-        db.add(
-            models.TicketRecommendation(
-                ticket_id=ticket.id,
-                kb_item_id=rec["kb_id"],
-                similarity=rec["similarity"],
-                rank=rec["rank"],
-            )
-        )
+        rec_data = get_recommendations(ticket.description, kb_data)
 
-    await db.commit()
+        if cluster:
+            cluster.recommendations = rec_data
+
+    # Строки рекомендаций записываются пачкой из буфера
+    write_buffer.add_recommendations(ticket.id, rec_data["recommendations"])
 
     return {
         "ticket_id": ticket.id,
@@ -269,30 +452,27 @@ async def resolve_ticket(
     if ticket.status_id != 2:
         raise HTTPException(status_code=400, detail="Заявка не в работе")
 
-    ticket.status_id = 3
-    added_to_kb = False
+    used_kb = bool(data.used_kb and data.accepted_kb_id)
 
-    if data.used_kb and data.accepted_kb_id:
-        result = await db.execute(
-            select(models.KnowledgeItem)
-            .where(models.KnowledgeItem.id == data.accepted_kb_id)
-        )
-        kb_item = result.scalar_one_or_none()
+    if not used_kb and not data.applied_solution.strip():
+        raise HTTPException(status_code=400, detail="Введите решение")
 
-        if kb_item:
-            kb_item.frequency += 1
+    # Условное обновление: из параллельных запросов на выполнение одной
+    # заявки статус сменит только один
+    result = await db.execute(
+        update(models.Ticket)
+        .where(models.Ticket.id == ticket.id)
+        .where(models.Ticket.status_id == 2)
+        .values(status_id=3)
+    )
 
-        await db.execute(
-            update(models.TicketRecommendation)
-            .where(models.TicketRecommendation.ticket_id == ticket.id)
-            .where(models.TicketRecommendation.kb_item_id == data.accepted_kb_id)
-            .values(was_accepted=True)
-        )
+    if result.rowcount == 0:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Заявка не в работе")
 
-    else:
-        if not data.applied_solution.strip():
-            raise HTTPException(status_code=400, detail="Введите решение")
+    added_to_kb = False
 
+    if not used_kb:
         result = await db.execute(
             select(models.KnowledgeItem)
             .where(models.KnowledgeItem.solution.ilike(
@@ -314,6 +494,19 @@ async def resolve_ticket(
 
     await db.commit()
 
+    if used_kb:
+        # Счётчик популярной записи и отметка о принятой рекомендации
+        # записываются через буфер и только после успешной фиксации
+        write_buffer.add_frequency(data.accepted_kb_id)
+        write_buffer.add_accepted(ticket.id, data.accepted_kb_id)
+
+    versions.bump(versions.ASSIGNED_QUEUE, ticket.specialist_user_id)
+    versions.bump(versions.MY_QUEUE, ticket.client_user_id)
+
+    clusterer.remove_tickets([ticket.id])
+    if added_to_kb:
+        clusterer.invalidate_recommendations()
+
     return {"message": "Заявка выполнена", "added_to_kb": added_to_kb}
 
 
@@ -341,6 +534,8 @@ async def confirm_ticket(
     if ticket.status_id != 3:
         raise HTTPException(status_code=400, detail="Заявка ещё не выполнена")
 
+    specialist_id = ticket.specialist_user_id
+
     if data.is_confirmed:
         ticket.status_id = 4
         msg = "Заявка закрыта"
@@ -350,15 +545,118 @@ async def confirm_ticket(
         msg = "Заявка возвращена в работу"
 
     await db.commit()
+
+    versions.bump(versions.MY_QUEUE, user.id)
+    if specialist_id:
+        versions.bump(versions.ASSIGNED_QUEUE, specialist_id)
+
     return {"message": msg}
 
 
+# -------------------- ИНЦИДЕНТЫ --------------------
+
+@app.get("/api/clusters", response_model=List[schemas.ClusterResponse])
+async def get_clusters(
+    user_id: int,
+    min_size: int = 2,
+    db: AsyncSession = Depends(get_db),
+):
+    user = await get_user(db, user_id)
+    require_role(user, "specialist")
+
+    return [
+        {
+            "id": c.id,
+            "description": c.description,
+            "size": len(c.ticket_ids),
+            "total": c.total,
+            "ticket_ids": sorted(c.ticket_ids),
+            "has_recommendations": c.recommendations is not None,
+            "recommendations": (
+                c.recommendations["recommendations"] if c.recommendations else []
+            ),
+            "created_at": c.created_at,
+            "updated_at": c.updated_at,
+        }
+        for c in clusterer.clusters(min_size)
+    ]
+
+
+@app.post("/api/clusters/{cluster_id}/resolve")
+async def resolve_cluster(
+    cluster_id: int,
+    data: schemas.ClusterResolveRequest,
+    user_id: int,
+    db: AsyncSession = Depends(get_db),
+):
+    user = await get_user(db, user_id)
+    require_role(user, "specialist")
+
+    cluster = clusterer.get(cluster_id)
+
+    if not cluster:
+        raise HTTPException(status_code=404, detail="Кластер не найден")
+
+    result = await db.execute(
+        select(models.KnowledgeItem.id)
+        .where(models.KnowledgeItem.id == data.kb_item_id)
+    )
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Запись базы знаний не найдена")
+
+    # Номера кластеров живут в памяти процесса и меняются после перезапуска,
+    # поэтому выполняются только заявки, которые специалист видел и которые
+    # по-прежнему входят в кластер
+    ticket_ids = cluster.ticket_ids.intersection(data.ticket_ids)
+
+    if not ticket_ids:
+        raise HTTPException(status_code=409, detail="Состав кластера изменился")
+
+    # Открытые заявки и заявки этого специалиста; чужие заявки в работе
+    # и заблокированные параллельными запросами пропускаются
+    result = await db.execute(
+        select(models.Ticket)
+        .where(models.Ticket.id.in_(list(ticket_ids)))
+        .where(
+            (models.Ticket.status_id == 1)
+            | (
+                (models.Ticket.status_id == 2)
+                & (models.Ticket.specialist_user_id == user.id)
+            )
+        )
+        .with_for_update(skip_locked=True)
+    )
+    tickets = result.scalars().all()
+
+    for ticket in tickets:
+        ticket.status_id = 3
+        ticket.specialist_user_id = user.id
+
+    await db.commit()
+
+    if tickets:
+        write_buffer.add_frequency(data.kb_item_id, len(tickets))
+
+    versions.bump(versions.OPEN_QUEUE)
+    versions.bump(versions.ASSIGNED_QUEUE, user.id)
+    for client_id in {t.client_user_id for t in tickets}:
+        versions.bump(versions.MY_QUEUE, client_id)
+
+    clusterer.remove_tickets([t.id for t in tickets])
+
+    return {"message": "Заявки кластера выполнены", "resolved": len(tickets)}
+
+
 # -------------------- БАЗА ЗНАНИЙ --------------------
 
-@app.get("/api/knowledge", response_model=List[schemas.KnowledgeItemResponse])
+@app.get(
+    "/api/knowledge",
+    response_model=List[schemas.KnowledgeItemResponse],
+    dependencies=[Depends(admission.limit("knowledge"))],
+)
 async def get_knowledge(
     user_id: int,
-    limit: int = 30,
+    limit: int = Query(30, ge=1, le=1000),
     db: AsyncSession = Depends(get_db),
 ):
     user = await get_user(db, user_id)
@@ -372,16 +670,53 @@ async def get_knowledge(
     return result.scalars().all()
 
 
+# -------------------- ПОИСК --------------------
+
+@app.get(
+    "/api/search",
+    response_model=schemas.SearchResponse,
+    dependencies=[Depends(admission.limit("search"))],
+)
+async def search(
+    user_id: int,
+    q: str = Query(..., min_length=2, max_length=200),
+    scope: str = Query("all", pattern="^(all|tickets|knowledge)$"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+    db: AsyncSession = Depends(get_db),
+):
+    user = await get_user(db, user_id)
+    require_role(user, "specialist")
+
+    results, has_more = await run_search(db, q, scope, limit, offset)
+
+    return {
+        "query": q,
+        "offset": offset,
+        "limit": limit,
+        "has_more": has_more,
+        "results": results,
+    }
+
+
 # -------------------- СТАТИСТИКА --------------------
 
 @app.get("/api/stats")
-async def get_stats(user_id: int, db: AsyncSession = Depends(get_db)):
+async def get_stats(
+    user_id: int,
+    history: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
     user = await get_user(db, user_id)
     require_role(user, "admin")
 
     result = await db.execute(select(func.count(models.Ticket.id)))
     tickets_total = result.scalar() or 0
 
+    if history:
+        result = await db.execute(select(func.count(models.TicketArchive.id)))
+        tickets_total += result.scalar() or 0
+
     result = await db.execute(
         select(func.count(models.Ticket.id))
         .where(models.Ticket.status_id == 1)
@@ -400,3 +735,51 @@ async def get_stats(user_id: int, db: AsyncSession = Depends(get_db)):
         "knowledge_total": knowledge_total,
         "knowledge_usage": knowledge_usage,
     }
+
+
+@app.get("/api/admission")
+async def get_admission_stats(user_id: int, db: AsyncSession = Depends(get_db)):
+    user = await get_user(db, user_id)
+    require_role(user, "admin")
+
+    return {
+        "enabled": admission.ADMISSION_ENABLED,
+        "routes": admission.stats(),
+    }
+
+
+# -------------------- ПРОФИЛИРОВАНИЕ --------------------
+
+@app.get("/api/profiles")
+async def get_profiles(user_id: int, db: AsyncSession = Depends(get_db)):
+    user = await get_user(db, user_id)
+    require_role(user, "admin")
+
+    return {
+        "enabled": profiling.PROFILING_ENABLED,
+        "slow_ms": profiling.PROFILE_SLOW_MS,
+        "profiles": profiling.profiles.list(),
+    }
+
+
+@app.get("/api/profiles/{profile_id}", response_class=PlainTextResponse)
+async def download_profile(
+    profile_id: int,
+    user_id: int,
+    db: AsyncSession = Depends(get_db),
+):
+    user = await get_user(db, user_id)
+    require_role(user, "admin")
+
+    collapsed = profiling.profiles.collapsed(profile_id)
+
+    if collapsed is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+
+    # Формат collapsed stacks: открывается в speedscope или flamegraph.pl
+    return PlainTextResponse(
+        collapsed,
+        headers={
+            "Content-Disposition": f'attachment; filename="profile-{profile_id}.txt"'
+        },
+    )
@@ -1,10 +1,14 @@
 from sqlalchemy import Boolean
 from sqlalchemy import Column
+from sqlalchemy import Computed
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import String
 from sqlalchemy import Text
 from sqlalchemy import TIMESTAMP
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -53,6 +57,7 @@ class Ticket(Base):
     contact_info = Column(String(500), nullable=False)
 
     status_id = Column(Integer, ForeignKey("ticket_statuses.id"), nullable=False)
+    priority = Column(Integer, nullable=False, default=0, server_default="0")
     client_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     specialist_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
 
@@ -63,10 +68,29 @@ class Ticket(Base):
         onupdate=func.now(),
     )
 
+    # Полнотекстовый индекс описания (русская морфология PostgreSQL)
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed("to_tsvector('russian', description)", persisted=True),
+    ))
+
     status = relationship("TicketStatus")
     client = relationship("User", foreign_keys=[client_user_id])
     specialist = relationship("User", foreign_keys=[specialist_user_id])
 
+    # Индексы под выборку диспетчера: открытые заявки по приоритету
+    # и возрасту и, без учёта приоритета, в порядке поступления
+    __table_args__ = (
+        Index(
+            "ix_tickets_dispatch",
+            "status_id",
+            priority.desc(),
+            "created_at",
+        ),
+        Index("ix_tickets_fifo", "status_id", "created_at", "id"),
+        Index("ix_tickets_search", "search_vector", postgresql_using="gin"),
+    )
+
 
 class KnowledgeItem(Base):
     __tablename__ = "knowledge_base"
@@ -81,6 +105,20 @@ class KnowledgeItem(Base):
 
     created_at = Column(TIMESTAMP, server_default=func.now())
 
+    # Совпадения в описании проблемы ранжируются выше, чем в решении
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed(
+            "setweight(to_tsvector('russian', problem), 'A') || "
+            "setweight(to_tsvector('russian', solution), 'B')",
+            persisted=True,
+        ),
+    ))
+
+    __table_args__ = (
+        Index("ix_knowledge_base_search", "search_vector", postgresql_using="gin"),
+    )
+
 
 class TicketRecommendation(Base):
     __tablename__ = "ticket_recommendations"
@@ -98,3 +136,50 @@ class TicketRecommendation(Base):
 
     ticket = relationship("Ticket")
     kb_item = relationship("KnowledgeItem")
+
+
+# -------------------- АРХИВ --------------------
+# Закрытые заявки переносятся в архивные таблицы с помесячным
+# секционированием по created_at. Секции создаются задачей архивации.
+
+class TicketArchive(Base):
+    __tablename__ = "tickets_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+
+    description = Column(Text, nullable=False)
+    contact_info = Column(String(500), nullable=False)
+
+    status_id = Column(Integer, nullable=False)
+    priority = Column(Integer, nullable=False, default=0)
+    client_user_id = Column(Integer, nullable=False)
+    specialist_user_id = Column(Integer, nullable=True)
+
+    created_at = Column(TIMESTAMP, primary_key=True)
+    updated_at = Column(TIMESTAMP)
+    archived_at = Column(TIMESTAMP, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_tickets_archive_client", "client_user_id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+class TicketRecommendationArchive(Base):
+    __tablename__ = "ticket_recommendations_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+
+    ticket_id = Column(Integer, nullable=False)
+    kb_item_id = Column(Integer, nullable=False)
+
+    similarity = Column(Integer, nullable=False)
+    rank = Column(Integer, nullable=False)
+
+    was_accepted = Column(Boolean, default=False)
+    created_at = Column(TIMESTAMP, primary_key=True)
+
+    __table_args__ = (
+        Index("ix_ticket_recommendations_archive_ticket", "ticket_id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
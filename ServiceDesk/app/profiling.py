@@ -0,0 +1,206 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from collections import deque
+from datetime import datetime
+from itertools import count
+from typing import Dict
+from typing import List
+from typing import Optional
+
+
+# Профилирование включается только явно; без него middleware не подключается
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+
+# Запросы дольше порога сохраняются в буфер профилей, миллисекунды
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "1000"))
+
+# Период снятия стека потока обработки запросов, миллисекунды
+PROFILE_SAMPLE_MS = float(os.getenv("PROFILE_SAMPLE_MS", "5"))
+
+# Сколько последних профилей хранить
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "50"))
+
+# Запрос с заголовком X-Profile-Token, равным этому значению,
+# профилируется независимо от длительности
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+
+# Сколько самых частых стеков показывать в списке профилей
+TOP_STACKS = 10
+
+
+def format_frame(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename.replace("\\", "/").split("/")
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{frame.f_lineno})"
+
+
+class StackSampler:
+    """
+    Фоновый поток, который периодически снимает стек потока событийного
+    цикла, пока обрабатывается хотя бы один запрос. Выборки за время
+    запроса сворачиваются в формат collapsed stacks (flamegraph.pl,
+    speedscope). Если запросы выполняются одновременно, в профиль
+    попадает вся работа цикла за это время.
+    """
+
+    def __init__(self, interval: float, max_samples: int = 20000):
+        self.interval = interval
+
+        self._samples: deque = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._inflight = 0
+        self._target: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def enter(self) -> None:
+        if self._thread is None:
+            self._target = threading.get_ident()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+        self._inflight += 1
+        self._active.set()
+
+    def exit(self) -> None:
+        self._inflight -= 1
+        if self._inflight == 0:
+            # Без активных запросов старые выборки больше не нужны
+            self._active.clear()
+            with self._lock:
+                self._samples.clear()
+
+    def _run(self) -> None:
+        while True:
+            self._active.wait()
+
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    stack.append(format_frame(frame))
+                    frame = frame.f_back
+                stack.reverse()
+
+                with self._lock:
+                    self._samples.append((time.monotonic(), ";".join(stack)))
+
+            time.sleep(self.interval)
+
+    def collect(self, started: float, finished: float) -> Counter:
+        with self._lock:
+            samples = list(self._samples)
+
+        return Counter(
+            stack for ts, stack in samples
+            if started <= ts <= finished
+        )
+
+
+class ProfileStore:
+    """
+    Кольцевой буфер последних профилей медленных запросов.
+    """
+
+    def __init__(self, size: int):
+        self._profiles: deque = deque(maxlen=size)
+        self._ids = count(1)
+
+    def add(
+        self,
+        method: str,
+        path: str,
+        status: int,
+        duration_ms: float,
+        stacks: Counter,
+    ) -> None:
+        self._profiles.append({
+            "id": next(self._ids),
+            "method": method,
+            "path": path,
+            "status": status,
+            "duration_ms": round(duration_ms, 1),
+            "created_at": datetime.now(),
+            "samples": sum(stacks.values()),
+            "stacks": stacks,
+        })
+
+    def list(self) -> List[Dict]:
+        return [
+            {
+                "id": p["id"],
+                "method": p["method"],
+                "path": p["path"],
+                "status": p["status"],
+                "duration_ms": p["duration_ms"],
+                "created_at": p["created_at"],
+                "samples": p["samples"],
+                "top_stacks": [
+                    {"stack": stack, "count": n}
+                    for stack, n in p["stacks"].most_common(TOP_STACKS)
+                ],
+            }
+            for p in reversed(self._profiles)
+        ]
+
+    def collapsed(self, profile_id: int) -> Optional[str]:
+        for p in self._profiles:
+            if p["id"] == profile_id:
+                return "\n".join(
+                    f"{stack} {n}" for stack, n in p["stacks"].most_common()
+                )
+        return None
+
+
+profiles = ProfileStore(PROFILE_BUFFER_SIZE)
+sampler = StackSampler(PROFILE_SAMPLE_MS / 1000)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware: сэмплирует стек во время запроса и сохраняет
+    профиль, если запрос был медленным или содержал токен профилирования.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        token = headers.get(b"x-profile-token", b"").decode()
+        forced = bool(PROFILING_TOKEN) and token == PROFILING_TOKEN
+
+        status = 0
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        sampler.enter()
+        started = time.monotonic()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finished = time.monotonic()
+            duration_ms = (finished - started) * 1000
+
+            if forced or duration_ms >= PROFILE_SLOW_MS:
+                profiles.add(
+                    scope["method"],
+                    scope["path"],
+                    status,
+                    duration_ms,
+                    sampler.collect(started, finished),
+                )
+
+            sampler.exit()
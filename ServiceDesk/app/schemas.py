@@ -21,6 +21,7 @@ class TicketResponse(BaseModel):
     description: str
     contact_info: str
     status_id: int
+    priority: int
     created_at: datetime
 
     class Config:
@@ -51,6 +52,46 @@ class ConfirmRequest(BaseModel):
     is_confirmed: bool
 
 
+class PriorityRequest(BaseModel):
+    priority: int = Field(..., ge=0, le=3)
+
+
+class ClusterResponse(BaseModel):
+    id: int
+    description: str
+    size: int
+    total: int
+    ticket_ids: List[int]
+    has_recommendations: bool
+    recommendations: List[RecommendationItem]
+    created_at: datetime
+    updated_at: datetime
+
+
+class ClusterResolveRequest(BaseModel):
+    kb_item_id: int
+    # Заявки, которые специалист видел в кластере при выборе решения
+    ticket_ids: List[int] = Field(..., min_length=1)
+
+
+class SearchResult(BaseModel):
+    type: str
+    id: int
+    rank: float
+    title: str
+    snippet: str
+    status_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+
+class SearchResponse(BaseModel):
+    query: str
+    offset: int
+    limit: int
+    has_more: bool
+    results: List[SearchResult]
+
+
 class KnowledgeItemResponse(BaseModel):
     id: int
     problem: str
@@ -0,0 +1,151 @@
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from sqlalchemy import func
+from sqlalchemy import literal_column
+from sqlalchemy import select
+from sqlalchemy import union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+
+# Конфигурация полнотекстового поиска PostgreSQL (стемминг русского языка)
+SEARCH_CONFIG = "russian"
+
+# Границы подсветки - символы из области частного использования Unicode,
+# а не HTML: текст заявок пишут клиенты, поэтому фрагменты возвращаются
+# как обычный текст, а разметку строит интерфейс после экранирования
+HIGHLIGHT_START = "\ue000"
+HIGHLIGHT_STOP = "\ue001"
+
+HIGHLIGHT_OPTIONS = f'StartSel="{HIGHLIGHT_START}", StopSel="{HIGHLIGHT_STOP}"'
+
+SNIPPET_OPTIONS = (
+    f"{HIGHLIGHT_OPTIONS}, "
+    "MaxWords=35, MinWords=15, MaxFragments=2, FragmentDelimiter=\" ... \""
+)
+
+TITLE_OPTIONS = f"{HIGHLIGHT_OPTIONS}, MaxWords=15, MinWords=5"
+
+
+async def search(
+    db: AsyncSession,
+    text: str,
+    scope: str,
+    limit: int,
+    offset: int,
+) -> Tuple[List[Dict], bool]:
+    """
+    Ищет заявки и записи базы знаний по GIN-индексам tsvector.
+    Сначала выбирается страница идентификаторов по рангу, затем только
+    для неё строятся фрагменты с подсветкой: ts_headline дорогой.
+    Возвращает результаты страницы и признак наличия следующей.
+    """
+    query = func.websearch_to_tsquery(SEARCH_CONFIG, text)
+    parts = []
+
+    if scope in ("all", "tickets"):
+        parts.append(
+            select(
+                literal_column("'ticket'").label("kind"),
+                models.Ticket.id.label("id"),
+                func.ts_rank_cd(models.Ticket.search_vector, query).label("rank"),
+            )
+            .where(models.Ticket.search_vector.bool_op("@@")(query))
+        )
+
+    if scope in ("all", "knowledge"):
+        parts.append(
+            select(
+                literal_column("'knowledge'").label("kind"),
+                models.KnowledgeItem.id.label("id"),
+                func.ts_rank_cd(models.KnowledgeItem.search_vector, query).label("rank"),
+            )
+            .where(models.KnowledgeItem.search_vector.bool_op("@@")(query))
+        )
+
+    statement = union_all(*parts) if len(parts) > 1 else parts[0]
+
+    # Лишняя строка показывает, есть ли следующая страница,
+    # без подсчёта всех совпадений
+    result = await db.execute(
+        statement
+        .order_by(literal_column("rank").desc(), literal_column("id"))
+        .limit(limit + 1)
+        .offset(offset)
+    )
+    rows = result.all()
+
+    has_more = len(rows) > limit
+    page = rows[:limit]
+
+    ticket_ids = [r.id for r in page if r.kind == "ticket"]
+    kb_ids = [r.id for r in page if r.kind == "knowledge"]
+
+    details: Dict[Tuple[str, int], Dict] = {}
+
+    if ticket_ids:
+        result = await db.execute(
+            select(
+                models.Ticket.id,
+                models.Ticket.status_id,
+                models.Ticket.created_at,
+                func.ts_headline(
+                    SEARCH_CONFIG,
+                    models.Ticket.description,
+                    query,
+                    SNIPPET_OPTIONS,
+                ).label("snippet"),
+            )
+            .where(models.Ticket.id.in_(ticket_ids))
+        )
+        for r in result.all():
+            details[("ticket", r.id)] = {
+                "title": f"Заявка #{r.id}",
+                "snippet": r.snippet,
+                "status_id": r.status_id,
+                "created_at": r.created_at,
+            }
+
+    if kb_ids:
+        result = await db.execute(
+            select(
+                models.KnowledgeItem.id,
+                models.KnowledgeItem.created_at,
+                func.ts_headline(
+                    SEARCH_CONFIG,
+                    models.KnowledgeItem.problem,
+                    query,
+                    TITLE_OPTIONS,
+                ).label("title"),
+                func.ts_headline(
+                    SEARCH_CONFIG,
+                    models.KnowledgeItem.solution,
+                    query,
+                    SNIPPET_OPTIONS,
+                ).label("snippet"),
+            )
+            .where(models.KnowledgeItem.id.in_(kb_ids))
+        )
+        for r in result.all():
+            details[("knowledge", r.id)] = {
+                "title": r.title,
+                "snippet": r.snippet,
+                "status_id": None,
+                "created_at": r.created_at,
+            }
+
+    results = [
+        {
+            "type": r.kind,
+            "id": r.id,
+            "rank": r.rank,
+            **details[(r.kind, r.id)],
+        }
+        for r in page
+        if (r.kind, r.id) in details
+    ]
+
+    return results, has_more
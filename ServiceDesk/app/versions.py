@@ -0,0 +1,68 @@
+import os
+import uuid
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+
+# Счётчики версий хранятся в памяти процесса, поэтому ETag корректны только
+# при одном процессе приложения: иначе изменение на одном процессе не видно
+# другому, и тот продолжит отвечать 304 с устаревшим списком. Число процессов
+# (uvicorn --workers, gunicorn -w) надёжно не определить, поэтому ETag
+# включаются явно: QUEUE_ETAGS=1 только при запуске в одном процессе.
+ETAGS_ENABLED = (
+    os.getenv("QUEUE_ETAGS", "0") == "1"
+    and int(os.getenv("WEB_CONCURRENCY", "1")) <= 1
+)
+
+# Метка запуска процесса: после перезапуска счётчики начинаются заново,
+# поэтому старые ETag не должны совпасть с новыми
+BOOT_ID = uuid.uuid4().hex[:8]
+
+OPEN_QUEUE = "open"
+ASSIGNED_QUEUE = "assigned"
+MY_QUEUE = "my"
+
+_versions: Dict[Tuple[str, int], int] = {}
+
+
+def _key(queue: str, owner_id: Optional[int]) -> Tuple[str, int]:
+    return queue, owner_id or 0
+
+
+def get_version(queue: str, owner_id: Optional[int] = None) -> int:
+    return _versions.get(_key(queue, owner_id), 0)
+
+
+def bump(queue: str, owner_id: Optional[int] = None) -> None:
+    """
+    Увеличивает версию очереди после изменения входящих в неё заявок.
+    """
+    key = _key(queue, owner_id)
+    _versions[key] = _versions.get(key, 0) + 1
+
+
+def make_etag(
+    queue: str,
+    owner_id: Optional[int] = None,
+    variant: str = "",
+) -> str:
+    """
+    Формирует ETag очереди. variant различает представления одной
+    очереди с разным содержимым (например, с архивом и без).
+    """
+    version = get_version(queue, owner_id)
+    name = f"{queue}{variant}"
+    return f'W/"{name}-{owner_id or 0}-{BOOT_ID}-{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Проверяет заголовок If-None-Match на совпадение с текущим ETag.
+    """
+    if not if_none_match:
+        return False
+
+    # Слабое сравнение: префикс W/ не учитывается
+    candidates = [c.strip().removeprefix("W/") for c in if_none_match.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in candidates
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from sqlalchemy import column
+from sqlalchemy import insert
+from sqlalchemy import Integer
+from sqlalchemy import select
+from sqlalchemy import true
+from sqlalchemy import update
+from sqlalchemy import values
+
+from . import models
+from .database import SessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+# Максимальная задержка записи накопленных изменений в базу, секунды
+FLUSH_INTERVAL = float(os.getenv("WRITE_BUFFER_INTERVAL", "2"))
+
+# При таком числе накопленных записей сброс выполняется досрочно
+MAX_PENDING = int(os.getenv("WRITE_BUFFER_MAX_PENDING", "1000"))
+
+# Строк в одном INSERT: ограничение asyncpg на число параметров запроса
+INSERT_BATCH = 1000
+
+# Сколько раз повторять вставку рекомендаций после ошибки базы
+MAX_ATTEMPTS = 3
+
+
+class WriteBuffer:
+    """
+    Накапливает увеличения счётчиков frequency базы знаний, строки
+    ticket_recommendations и отметки о принятых рекомендациях в памяти
+    процесса и периодически записывает их пакетными запросами
+    UPDATE ... FROM (VALUES ...) и многострочным INSERT.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = FLUSH_INTERVAL,
+        max_pending: int = MAX_PENDING,
+    ):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._frequency: Dict[int, int] = {}
+        self._recommendations: List[Tuple[int, Dict]] = []
+        self._accepted: Set[Tuple[int, int]] = set()
+
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def pending(self) -> int:
+        return (
+            len(self._frequency)
+            + len(self._recommendations)
+            + len(self._accepted)
+        )
+
+    def _check_size(self) -> None:
+        if self.pending() >= self.max_pending:
+            self._wakeup.set()
+
+    def add_frequency(self, kb_item_id: int, delta: int = 1) -> None:
+        self._frequency[kb_item_id] = self._frequency.get(kb_item_id, 0) + delta
+        self._check_size()
+
+    def add_recommendations(self, ticket_id: int, recommendations: List[Dict]) -> None:
+        for rec in recommendations:
+            self._recommendations.append((0, {
+                "ticket_id": ticket_id,
+                "kb_item_id": rec["kb_id"],
+                "similarity": rec["similarity"],
+                "rank": rec["rank"],
+            }))
+        self._check_size()
+
+    def add_accepted(self, ticket_id: int, kb_item_id: int) -> None:
+        """
+        Запоминает принятую рекомендацию. Отметка записывается после
+        вставки накопленных строк, поэтому учитывает и ещё не записанные.
+        """
+        self._accepted.add((ticket_id, kb_item_id))
+        self._check_size()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            frequency, self._frequency = self._frequency, {}
+            recommendations, self._recommendations = self._recommendations, []
+            accepted, self._accepted = self._accepted, set()
+
+            if frequency:
+                await self._flush_frequency(frequency)
+
+            inserted = True
+            if recommendations:
+                inserted = await self._flush_recommendations(recommendations)
+
+            if accepted:
+                if inserted:
+                    await self._flush_accepted(accepted)
+                else:
+                    # Отмечаемые строки могли остаться в буфере на повтор:
+                    # отметка записывается после их вставки
+                    self._accepted |= accepted
+
+    async def _flush_frequency(self, frequency: Dict[int, int]) -> None:
+        # Сортировка по id задаёт одинаковый порядок блокировок строк
+        # для всех процессов приложения
+        deltas = values(
+            column("id", Integer),
+            column("delta", Integer),
+            name="deltas",
+        ).data(sorted(frequency.items()))
+
+        try:
+            async with SessionLocal() as db:
+                await db.execute(
+                    update(models.KnowledgeItem)
+                    .where(models.KnowledgeItem.id == deltas.c.id)
+                    .values(frequency=models.KnowledgeItem.frequency + deltas.c.delta)
+                )
+                await db.commit()
+        except Exception:
+            logger.exception("Не удалось записать счётчики базы знаний")
+
+            # Счётчики возвращаются в буфер и будут записаны при следующем сбросе
+            for kb_item_id, delta in frequency.items():
+                self._frequency[kb_item_id] = (
+                    self._frequency.get(kb_item_id, 0) + delta
+                )
+
+    async def _flush_recommendations(self, recommendations: List[Tuple[int, Dict]]) -> bool:
+        """
+        Вставляет накопленные рекомендации. Возвращает False, если вставка
+        не удалась и строки возвращены в буфер или отброшены.
+        """
+        rows = [
+            (r["ticket_id"], r["kb_item_id"], r["similarity"], r["rank"])
+            for _, r in recommendations
+        ]
+        tickets = models.Ticket.__table__
+        knowledge = models.KnowledgeItem.__table__
+
+        try:
+            async with SessionLocal() as db:
+                for start in range(0, len(rows), INSERT_BATCH):
+                    batch = values(
+                        column("ticket_id", Integer),
+                        column("kb_item_id", Integer),
+                        column("similarity", Integer),
+                        column("rank", Integer),
+                        name="batch",
+                    ).data(rows[start:start + INSERT_BATCH])
+
+                    # Соединение с заявками и базой знаний отбрасывает строки,
+                    # чьи заявки или записи уже удалены или перенесены в архив,
+                    # чтобы одна такая строка не срывала вставку всей пачки
+                    await db.execute(
+                        insert(models.TicketRecommendation).from_select(
+                            ["ticket_id", "kb_item_id", "similarity", "rank"],
+                            select(
+                                batch.c.ticket_id,
+                                batch.c.kb_item_id,
+                                batch.c.similarity,
+                                batch.c.rank,
+                            )
+                            .select_from(
+                                batch
+                                .join(tickets, tickets.c.id == batch.c.ticket_id)
+                                .join(knowledge, knowledge.c.id == batch.c.kb_item_id)
+                            ),
+                        )
+                    )
+                await db.commit()
+        except Exception:
+            logger.exception("Не удалось записать рекомендации")
+
+            retry = [
+                (attempts + 1, row)
+                for attempts, row in recommendations
+                if attempts + 1 < MAX_ATTEMPTS
+            ]
+            self._recommendations[:0] = retry
+            return False
+
+        return True
+
+    async def _flush_accepted(self, accepted: Set[Tuple[int, int]]) -> None:
+        pairs = values(
+            column("ticket_id", Integer),
+            column("kb_item_id", Integer),
+            name="accepted",
+        ).data(sorted(accepted))
+
+        try:
+            async with SessionLocal() as db:
+                await db.execute(
+                    update(models.TicketRecommendation)
+                    .where(models.TicketRecommendation.ticket_id == pairs.c.ticket_id)
+                    .where(models.TicketRecommendation.kb_item_id == pairs.c.kb_item_id)
+                    .values(was_accepted=true())
+                )
+                await db.commit()
+        except Exception:
+            logger.exception("Не удалось отметить принятые рекомендации")
+            self._accepted |= accepted
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Останавливает фоновую запись и сбрасывает оставшиеся изменения.
+        """
+        if self._task is not None:
+            # Задача не отменяется, чтобы не потерять пачку посреди записи
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+        await self.flush()
+
+
+write_buffer = WriteBuffer()
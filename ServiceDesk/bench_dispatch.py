@@ -0,0 +1,171 @@
+"""
+Нагрузочная проверка выдачи заявок специалистам.
+
+Создаёт пачку открытых заявок и разбирает её множеством параллельных
+"специалистов" двумя способами (затрагиваются только тестовые заявки):
+
+* scan   - как в интерфейсе: список открытых заявок и assign первой из них;
+* next   - через claim_next_ticket (FOR UPDATE SKIP LOCKED).
+
+Для каждого способа выводится время, число неудачных попыток
+("Заявка уже в работе") и число заявок, выданных сразу нескольким
+специалистам. Требуется база, созданная create_db.py.
+
+Пример: python bench_dispatch.py --tickets 2000 --specialists 50
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+from sqlalchemy import delete
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import models
+from app.database import DATABASE_URL
+from app.dispatch import claim_next_ticket
+
+
+BENCH_CONTACT = "bench_dispatch"
+
+
+async def get_user_id(session_factory, email: str) -> int:
+    async with session_factory() as db:
+        result = await db.execute(
+            select(models.User.id).where(models.User.email == email)
+        )
+        return result.scalar_one()
+
+
+async def prepare_tickets(session_factory, count: int, client_id: int) -> None:
+    async with session_factory() as db:
+        await db.execute(
+            delete(models.Ticket)
+            .where(models.Ticket.contact_info == BENCH_CONTACT)
+        )
+        db.add_all(
+            models.Ticket(
+                description=f"{BENCH_CONTACT}: тестовая заявка номер {i}",
+                contact_info=BENCH_CONTACT,
+                status_id=1,
+                priority=i % 4,
+                client_user_id=client_id,
+            )
+            for i in range(count)
+        )
+        await db.commit()
+
+
+async def cleanup(session_factory) -> None:
+    async with session_factory() as db:
+        await db.execute(
+            delete(models.Ticket)
+            .where(models.Ticket.contact_info == BENCH_CONTACT)
+        )
+        await db.commit()
+
+
+async def scan_worker(session_factory, specialist_id: int, claims, stats):
+    while True:
+        async with session_factory() as db:
+            result = await db.execute(
+                select(models.Ticket)
+                .where(models.Ticket.status_id == 1)
+                .where(models.Ticket.contact_info == BENCH_CONTACT)
+                .order_by(models.Ticket.created_at.desc())
+                .limit(20)
+            )
+            tickets = result.scalars().all()
+
+        if not tickets:
+            return
+
+        # Назначение - отдельный HTTP-запрос, поэтому и отдельная сессия:
+        # повторяет логику assign_ticket (чтение, проверка, запись)
+        async with session_factory() as db:
+            result = await db.execute(
+                select(models.Ticket).where(models.Ticket.id == tickets[0].id)
+            )
+            ticket = result.scalar_one()
+
+            if ticket.status_id != 1:
+                stats["failed"] += 1
+                continue
+
+            ticket.status_id = 2
+            ticket.specialist_user_id = specialist_id
+            await db.commit()
+
+            claims[ticket.id] += 1
+
+
+async def next_worker(session_factory, specialist_id: int, claims, stats):
+    while True:
+        async with session_factory() as db:
+            ticket = await claim_next_ticket(
+                db, specialist_id, skill=BENCH_CONTACT
+            )
+
+            if not ticket:
+                return
+
+            claims[ticket.id] += 1
+
+
+async def run(mode: str, args, session_factory, client_id, specialist_id):
+    await prepare_tickets(session_factory, args.tickets, client_id)
+
+    worker = scan_worker if mode == "scan" else next_worker
+    claims: Counter = Counter()
+    stats: Counter = Counter()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        worker(session_factory, specialist_id, claims, stats)
+        for _ in range(args.specialists)
+    ))
+    elapsed = time.perf_counter() - started
+
+    duplicated = sum(1 for n in claims.values() if n > 1)
+
+    print(
+        f"{mode:>5}: {len(claims)} заявок за {elapsed:.2f} с "
+        f"({len(claims) / elapsed:.0f} в секунду), "
+        f"неудачных попыток: {stats['failed']}, "
+        f"выдано повторно: {duplicated}"
+    )
+
+    await cleanup(session_factory)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickets", type=int, default=1000)
+    parser.add_argument("--specialists", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = create_async_engine(
+        DATABASE_URL,
+        pool_size=args.specialists,
+        max_overflow=0,
+    )
+    session_factory = async_sessionmaker(
+        engine,
+        class_=AsyncSession,
+        expire_on_commit=False,
+    )
+
+    client_id = await get_user_id(session_factory, "user@example.com")
+    specialist_id = await get_user_id(session_factory, "specialist@example.com")
+
+    for mode in ("scan", "next"):
+        await run(mode, args, session_factory, client_id, specialist_id)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -3,6 +3,8 @@ const API = "http://127.0.0.1:8000/api";
 let currentUser = null;
 let currentTicketId = null;
 let refreshTimer = null;
+let searchOffset = 0;
+let clustersById = {};
 
 document.addEventListener("DOMContentLoaded", () => {
     initTabs();
@@ -36,6 +38,7 @@ function initTabs() {
             if (tabId === "tab-assigned") loadAssignedTickets();
             if (tabId === "tab-kb") loadKnowledge();
             if (tabId === "tab-stats") loadStats();
+            if (tabId === "tab-clusters") loadClusters();
         });
     });
 }
@@ -166,7 +169,9 @@ function hideAllTabs() {
         "tab-open-btn",
         "tab-assigned-btn",
         "tab-kb-btn",
-        "tab-stats-btn"
+        "tab-stats-btn",
+        "tab-clusters-btn",
+        "tab-search-btn"
     ];
 
     tabIds.forEach(id => {
@@ -185,12 +190,16 @@ function showUserTabs() {
 function showSpecialistTabs() {
     document.getElementById("tab-open-btn").classList.remove("hidden");
     document.getElementById("tab-assigned-btn").classList.remove("hidden");
+    document.getElementById("tab-search-btn").classList.remove("hidden");
+    document.getElementById("tab-clusters-btn").classList.remove("hidden");
 }
 
 
 function showAdminTabs() {
     document.getElementById("tab-kb-btn").classList.remove("hidden");
     document.getElementById("tab-stats-btn").classList.remove("hidden");
+    document.getElementById("tab-clusters-btn").classList.remove("hidden");
+    document.getElementById("tab-search-btn").classList.remove("hidden");
 }
 
 
@@ -314,10 +323,21 @@ function renderTickets(tickets, containerId, showAssign, showDetails) {
         let buttons = "";
 
         if (showAssign) {
+            const priorities = ["Обычный", "Повышенный", "Высокий", "Срочный"]
+                .map((name, value) => `
+                    <option value="${value}" ${value === t.priority ? "selected" : ""}>
+                        ${name}
+                    </option>
+                `).join("");
+
             buttons += `
                 <button class="btn" onclick="assignTicket(${t.id})">
                     Взять
                 </button>
+
+                <select onchange="setTicketPriority(${t.id}, this.value)">
+                    ${priorities}
+                </select>
             `;
         }
 
@@ -431,6 +451,58 @@ async function assignTicket(ticketId) {
 }
 
 
+async function setTicketPriority(ticketId, priority) {
+    try {
+        const r = await fetch(
+            `${API}/tickets/${ticketId}/priority?user_id=${currentUser.id}`,
+            {
+                method: "PUT",
+                headers: {"Content-Type": "application/json"},
+                body: JSON.stringify({priority: Number(priority)})
+            }
+        );
+
+        if (!r.ok) {
+            showMessage("Ошибка изменения приоритета", "err");
+            loadOpenTickets();
+            return;
+        }
+
+        showMessage("Приоритет изменён");
+    } catch (err) {
+        showMessage("Ошибка соединения", "err");
+    }
+}
+
+
+async function takeNextTicket() {
+    try {
+        const r = await fetch(
+            `${API}/tickets/next?user_id=${currentUser.id}`,
+            {method: "POST"}
+        );
+
+        if (r.status === 404) {
+            showMessage("Нет открытых заявок", "err");
+            return;
+        }
+
+        if (!r.ok) {
+            showMessage("Ошибка назначения заявки", "err");
+            return;
+        }
+
+        const ticket = await r.json();
+
+        showMessage(`Заявка #${ticket.id} взята в работу`);
+        loadOpenTickets();
+        loadAssignedTickets();
+    } catch (err) {
+        showMessage("Ошибка соединения", "err");
+    }
+}
+
+
 async function openTicket(ticketId) {
     currentTicketId = ticketId;
     openDetailsTab();
@@ -648,6 +720,229 @@ async function loadStats() {
 }
 
 
+function escapeHtml(text) {
+    const div = document.createElement("div");
+    div.innerText = text;
+    return div.innerHTML;
+}
+
+
+// Поиск помечает совпадения символами \uE000 и \uE001; разметка
+// добавляется только после экранирования текста
+function highlight(text) {
+    return escapeHtml(text)
+        .replaceAll("\uE000", "<mark>")
+        .replaceAll("\uE001", "</mark>");
+}
+
+
+function searchAll(event) {
+    event.preventDefault();
+
+    searchOffset = 0;
+    document.getElementById("search-list").innerHTML = "";
+    loadSearchPage();
+}
+
+
+async function loadSearchPage() {
+    const q = document.getElementById("search-query").value.trim();
+    const scope = document.getElementById("search-scope").value;
+    const limit = 20;
+
+    try {
+        const r = await fetch(
+            `${API}/search?user_id=${currentUser.id}` +
+            `&q=${encodeURIComponent(q)}&scope=${scope}` +
+            `&limit=${limit}&offset=${searchOffset}`
+        );
+
+        if (!r.ok) {
+            showMessage("Ошибка поиска", "err");
+            return;
+        }
+
+        const data = await r.json();
+        const box = document.getElementById("search-list");
+
+        if (searchOffset === 0 && data.results.length === 0) {
+            box.innerHTML = "<div>Ничего не найдено</div>";
+        }
+
+        data.results.forEach(item => {
+            const div = document.createElement("div");
+            div.className = "ticket";
+
+            const badge = item.type === "ticket"
+                ? `<span class="badge ${statusClass(item.status_id)}">${statusText(item.status_id)}</span>`
+                : `<span class="badge gray">База знаний</span>`;
+
+            div.innerHTML = `
+                <div class="ticket-title">
+                    <b>${highlight(item.title)}</b>
+                    ${badge}
+                </div>
+
+                <div>${highlight(item.snippet)}</div>
+            `;
+
+            box.appendChild(div);
+        });
+
+        searchOffset += data.results.length;
+
+        const more = document.getElementById("search-more");
+        if (data.has_more) more.classList.remove("hidden");
+        else more.classList.add("hidden");
+    } catch (err) {
+        showMessage("Ошибка соединения", "err");
+    }
+}
+
+
+async function loadClusters() {
+    try {
+        const r = await fetch(`${API}/clusters?user_id=${currentUser.id}`);
+        if (!r.ok) return;
+
+        const clusters = await r.json();
+        const box = document.getElementById("clusters-list");
+        box.innerHTML = "";
+        clustersById = {};
+
+        if (!clusters || clusters.length === 0) {
+            box.innerHTML = "<div>Массовых инцидентов нет</div>";
+            return;
+        }
+
+        clusters.forEach(c => {
+            clustersById[c.id] = c;
+
+            const div = document.createElement("div");
+            div.className = "ticket";
+
+            let actions = "";
+
+            if (c.recommendations.length > 0) {
+                const options = c.recommendations.map(rec => `
+                    <option value="${rec.kb_id}">
+                        ${rec.similarity}% - ${escapeHtml(rec.problem.substring(0, 80))}
+                    </option>
+                `).join("");
+
+                actions = `
+                    <select id="cluster-kb-${c.id}">${options}</select>
+
+                    <button class="btn btn-green" onclick="resolveCluster(${c.id})">
+                        Выполнить все заявки
+                    </button>
+                `;
+            } else {
+                actions = `
+                    <button class="btn btn-light" onclick="loadClusterRecommendations(${c.id})">
+                        Подобрать решение
+                    </button>
+                `;
+            }
+
+            div.innerHTML = `
+                <div class="ticket-title">
+                    <b>Инцидент #${c.id}</b>
+                    <span class="badge red">
+                        Заявок: ${c.size}
+                    </span>
+                </div>
+
+                <div><b>Описание:</b> ${escapeHtml(c.description.substring(0, 160))}...</div>
+
+                <div style="margin-top: 8px;">
+                    <b>Заявки:</b> ${c.ticket_ids.map(id => "#" + id).join(", ")}
+                </div>
+
+                <div style="margin-top: 12px;">
+                    ${actions}
+                </div>
+            `;
+
+            box.appendChild(div);
+        });
+    } catch (err) {
+        showMessage("Ошибка загрузки инцидентов", "err");
+    }
+}
+
+
+async function loadClusterRecommendations(clusterId) {
+    const cluster = clustersById[clusterId];
+    if (!cluster) return;
+
+    try {
+        // Рекомендации первой заявки кэшируются для всего кластера
+        const r = await fetch(
+            `${API}/tickets/${cluster.ticket_ids[0]}/recommendations?user_id=${currentUser.id}`
+        );
+
+        if (!r.ok) {
+            showMessage("Ошибка получения рекомендаций", "err");
+            return;
+        }
+
+        const data = await r.json();
+
+        if (!data.recommendations || data.recommendations.length === 0) {
+            showMessage("Подходящих решений в базе знаний нет", "err");
+            return;
+        }
+
+        loadClusters();
+    } catch (err) {
+        showMessage("Ошибка соединения", "err");
+    }
+}
+
+
+async function resolveCluster(clusterId) {
+    const cluster = clustersById[clusterId];
+    if (!cluster) return;
+
+    const kb_item_id = Number(
+        document.getElementById(`cluster-kb-${clusterId}`).value
+    );
+
+    try {
+        const r = await fetch(
+            `${API}/clusters/${clusterId}/resolve?user_id=${currentUser.id}`,
+            {
+                method: "POST",
+                headers: {"Content-Type": "application/json"},
+                body: JSON.stringify({
+                    kb_item_id,
+                    ticket_ids: cluster.ticket_ids
+                })
+            }
+        );
+
+        if (r.status === 409) {
+            showMessage("Состав инцидента изменился, список обновлён", "err");
+            loadClusters();
+            return;
+        }
+
+        if (!r.ok) {
+            showMessage("Ошибка выполнения заявок", "err");
+            return;
+        }
+
+        const data = await r.json();
+
+        showMessage(`Выполнено заявок: ${data.resolved}`);
+        loadClusters();
+    } catch (err) {
+        showMessage("Ошибка соединения", "err");
+    }
+}
+
+
 function roleName(code) {
     if (code === "user") return "Пользователь";
     if (code === "specialist") return "Специалист";